@@ -2,9 +2,11 @@ from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type
 
 import json
+from contextlib import contextmanager
 
 from ansible.errors import AnsibleError
 from ansible.module_utils._text import to_text
+from ansible.module_utils.six import string_types
 from ansible.module_utils.parsing.convert_bool import boolean
 from ansible.parsing.yaml.objects import AnsibleUnicode
 from ansible.plugins.action import ActionBase
@@ -16,29 +18,75 @@ except ImportError:
     display = Display()
 
 
+class _UpdateTotals(object):
+    """ Aggregated win_updates results across automatic reboots """
+
+    __slots__ = ('changed', 'updates', 'filtered_updates', 'found',
+                 'installed')
+
+    def __init__(self, result):
+        self.changed = result['changed']
+        self.updates = result.get('updates') or {}
+        self.filtered_updates = result.get('filtered_updates') or {}
+        self.found = result.get('found_update_count', 0) or 0
+        self.installed = result.get('installed_update_count', 0) or 0
+
+    def merge(self, result):
+        self.updates.update(result.get('updates') or {})
+        self.filtered_updates.update(result.get('filtered_updates') or {})
+        self.found += result.get('found_update_count', 0) or 0
+        self.installed += result.get('installed_update_count', 0) or 0
+        if result['changed']:
+            self.changed = True
+
+    def as_dict(self):
+        return {
+            'changed': self.changed,
+            'updates': self.updates,
+            'filtered_updates': self.filtered_updates,
+            'found_update_count': self.found,
+            'installed_update_count': self.installed,
+        }
+
+
 class ActionModule(ActionBase):
 
     DEFAULT_REBOOT_TIMEOUT = 1200
 
+    _VALID_CATEGORIES = frozenset((
+        'Application',
+        'Connectors',
+        'CriticalUpdates',
+        'DefinitionUpdates',
+        'DeveloperKits',
+        'FeaturePacks',
+        'Guidance',
+        'SecurityUpdates',
+        'ServicePacks',
+        'Tools',
+        'UpdateRollups',
+        'Updates',
+    ))
+    _VALID_CATEGORIES_STR = ','.join(sorted(_VALID_CATEGORIES))
+    _DEFAULT_CATEGORIES = (
+        'CriticalUpdates',
+        'SecurityUpdates',
+        'UpdateRollups',
+    )
+    _WUA_BUSY_COMMAND = "(New-Object -ComObject Microsoft.Update.Session)." \
+                        "CreateUpdateInstaller().IsBusy"
+
     def _validate_categories(self, category_names):
-        valid_categories = [
-            'Application',
-            'Connectors',
-            'CriticalUpdates',
-            'DefinitionUpdates',
-            'DeveloperKits',
-            'FeaturePacks',
-            'Guidance',
-            'SecurityUpdates',
-            'ServicePacks',
-            'Tools',
-            'UpdateRollups',
-            'Updates'
-        ]
-        for name in category_names:
-            if name not in valid_categories:
-                raise AnsibleError("Unknown category_name %s, must be one of "
-                                   "(%s)" % (name, ','.join(valid_categories)))
+        invalid = [name for name in category_names
+                   if not isinstance(name, string_types) or
+                   name not in self._VALID_CATEGORIES]
+        if invalid:
+            if len(invalid) == 1:
+                msg = "Unknown category_name %s, must be one of (%s)"
+            else:
+                msg = "Unknown category_name(s) %s; must be one of (%s)"
+            raise AnsibleError(msg % (','.join(to_text(n) for n in invalid),
+                                      self._VALID_CATEGORIES_STR))
 
     def _run_win_updates(self, module_args, task_vars):
         display.vvv("win_updates: running win_updates module")
@@ -48,13 +96,29 @@ class ActionModule(ActionBase):
                                       wrap_async=self._task.async_val)
         return result
 
+    @contextmanager
+    def _become_as_system(self):
+        # temporarily run as SYSTEM through runas, restoring the original
+        # become settings afterwards
+        play_context = self._play_context
+        orig_become = play_context.become
+        orig_become_method = play_context.become_method
+        orig_become_user = play_context.become_user
+        play_context.become = True
+        play_context.become_method = 'runas'
+        play_context.become_user = 'SYSTEM'
+        try:
+            yield
+        finally:
+            play_context.become = orig_become
+            play_context.become_method = orig_become_method
+            play_context.become_user = orig_become_user
+
     def _reboot_server(self, task_vars, reboot_timeout):
         display.vvv("win_updates: rebooting remote host after update install")
-        reboot_args = {
-            'reboot_timeout': reboot_timeout
-        }
-        reboot_result = self._run_action_plugin('win_reboot', task_vars,
-                                                module_args=reboot_args)
+        reboot_result = self._run_action_plugin(
+            'win_reboot', task_vars,
+            module_args={'reboot_timeout': reboot_timeout})
         if reboot_result.get('failed', False):
             raise AnsibleError(reboot_result['msg'])
 
@@ -64,36 +128,20 @@ class ActionModule(ActionBase):
         # value until Windows is actually ready and finished installing updates
         # This needs to run with become as WUA doesn't work over WinRM
         # Ignore connection errors as another reboot can happen
-        command = "(New-Object -ComObject Microsoft.Update.Session)." \
-                  "CreateUpdateInstaller().IsBusy"
-        shell_module_args = {
-            '_raw_params': command
-        }
-
-        # run win_shell module with become and ignore any errors in case of
-        # a windows reboot during execution
-        orig_become = self._play_context.become
-        orig_become_method = self._play_context.become_method
-        orig_become_user = self._play_context.become_user
-        if orig_become is None or orig_become is False:
-            self._play_context.become = True
-        if orig_become_method != 'runas':
-            self._play_context.become_method = 'runas'
-        if orig_become_user is None or 'root':
-            self._play_context.become_user = 'SYSTEM'
         try:
-            shell_result = self._execute_module(module_name='win_shell',
-                                                module_args=shell_module_args,
-                                                task_vars=task_vars)
-            display.vvv("win_updates: shell wait results: %s"
-                        % json.dumps(shell_result))
+            # run win_shell module with become and ignore any errors in case
+            # of a windows reboot during execution
+            with self._become_as_system():
+                shell_result = self._execute_module(
+                    module_name='win_shell',
+                    module_args={'_raw_params': self._WUA_BUSY_COMMAND},
+                    task_vars=task_vars)
+            if display.verbosity >= 3:
+                display.vvv("win_updates: shell wait results: %s"
+                            % json.dumps(shell_result))
         except Exception as exc:
             display.debug("win_updates: Fatal error when running shell "
                           "command, attempting to recover: %s" % to_text(exc))
-        finally:
-            self._play_context.become = orig_become
-            self._play_context.become_method = orig_become_method
-            self._play_context.become_user = orig_become_user
 
         display.vvv("win_updates: ensure the connection is up and running")
         # in case Windows needs to reboot again after the updates, we wait for
@@ -124,11 +172,6 @@ class ActionModule(ActionBase):
         )
         return action.run(task_vars=task_vars)
 
-    def _merge_dict(self, original, new):
-        dict_var = original.copy()
-        dict_var.update(new)
-        return dict_var
-
     def run(self, tmp=None, task_vars=None):
         self._supports_check_mode = True
         self._supports_async = True
@@ -136,26 +179,25 @@ class ActionModule(ActionBase):
         result = super(ActionModule, self).run(tmp, task_vars)
         del tmp  # tmp no longer has any effect
 
-        category_names = self._task.args.get('category_names', [
-            'CriticalUpdates',
-            'SecurityUpdates',
-            'UpdateRollups',
-        ])
+        category_names = self._task.args.get('category_names',
+                                             self._DEFAULT_CATEGORIES)
         if isinstance(category_names, AnsibleUnicode):
-            category_names = [cat.strip() for cat in category_names.split(",")]
+            category_names = tuple(cat.strip()
+                                   for cat in category_names.split(","))
 
         state = self._task.args.get('state', 'installed')
         reboot = self._task.args.get('reboot', False)
         reboot_timeout = self._task.args.get('reboot_timeout',
                                              self.DEFAULT_REBOOT_TIMEOUT)
 
-        # Validate the options
-        try:
-            self._validate_categories(category_names)
-        except AnsibleError as exc:
-            result['failed'] = True
-            result['msg'] = to_text(exc)
-            return result
+        # Validate the options, the default categories are known to be valid
+        if category_names is not self._DEFAULT_CATEGORIES:
+            try:
+                self._validate_categories(category_names)
+            except AnsibleError as exc:
+                result['failed'] = True
+                result['msg'] = to_text(exc)
+                return result
 
         if state not in ['installed', 'searched']:
             result['failed'] = True
@@ -181,26 +223,38 @@ class ActionModule(ActionBase):
             return result
 
         # Run the module
-        new_module_args = self._task.args.copy()
-        new_module_args.pop('reboot', None)
-        new_module_args.pop('reboot_timeout', None)
+        new_module_args = dict((k, v) for k, v in self._task.args.items()
+                               if k not in ('reboot', 'reboot_timeout'))
         result = self._run_win_updates(new_module_args, task_vars)
 
-        changed = result['changed']
-        updates = result.get('updates', dict())
-        filtered_updates = result.get('filtered_updates', dict())
-        found_update_count = result.get('found_update_count', 0)
-        installed_update_count = result.get('installed_update_count', 0)
+        totals = _UpdateTotals(result)
 
         # Handle automatic reboots if the reboot flag is set
         if reboot and state == 'installed' and not \
                 self._play_context.check_mode:
             previously_errored = False
-            while result['installed_update_count'] > 0 or \
-                    result['found_update_count'] > 0 or \
-                    result['reboot_required'] is True:
-                display.vvv("win_updates: check win_updates results for "
-                            "automatic reboot: %s" % json.dumps(result))
+            previous_run_state = None
+            while True:
+                installed = result.get('installed_update_count', 0) or 0
+                found = result.get('found_update_count', 0) or 0
+                reboot_required = result.get('reboot_required', False)
+
+                # the host has converged once nothing was found or installed
+                # and no reboot is pending
+                if installed == 0 and found == 0 and \
+                        reboot_required is not True:
+                    break
+
+                # stop if the last run installed nothing and reported the same
+                # state as the one before it, another reboot won't change that
+                run_state = (installed, found, reboot_required)
+                if run_state == previous_run_state and installed == 0:
+                    break
+                previous_run_state = run_state
+
+                if display.verbosity >= 3:
+                    display.vvv("win_updates: check win_updates results for "
+                                "automatic reboot: %s" % json.dumps(result))
 
                 # check if the module failed, break from the loop if it
                 # previously failed and return error to the user
@@ -218,12 +272,12 @@ class ActionModule(ActionBase):
                     reboot_error = "reboot was required before more updates " \
                                    "can be installed"
 
-                if result.get('reboot_required', False):
+                if reboot_required:
                     if reboot_error is None:
                         reboot_error = "reboot was required to finalise " \
                                        "update install"
                     try:
-                        changed = True
+                        totals.changed = True
                         self._reboot_server(task_vars, reboot_timeout)
                     except AnsibleError as exc:
                         result['failed'] = True
@@ -236,23 +290,11 @@ class ActionModule(ActionBase):
                 # rerun the win_updates module after the reboot is complete
                 result = self._run_win_updates(new_module_args, task_vars)
 
-                result_updates = result.get('updates', dict())
-                result_filtered_updates = result.get('filtered_updates', dict())
-                updates = self._merge_dict(updates, result_updates)
-                filtered_updates = self._merge_dict(filtered_updates,
-                                                    result_filtered_updates)
-                found_update_count += result.get('found_update_count', 0)
-                installed_update_count += result.get('installed_update_count', 0)
-                if result['changed']:
-                    changed = True
+                totals.merge(result)
 
         # finally create the return dict based on the aggregated execution
         # values if we are not in async
         if self._task.async_val == 0:
-            result['changed'] = changed
-            result['updates'] = updates
-            result['filtered_updates'] = filtered_updates
-            result['found_update_count'] = found_update_count
-            result['installed_update_count'] = installed_update_count
+            result.update(totals.as_dict())
 
         return result
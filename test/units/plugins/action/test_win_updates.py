@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Ansible Project
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from ansible.compat.tests import unittest
+from ansible.compat.tests.mock import MagicMock, Mock
+from ansible.parsing.yaml.objects import AnsibleUnicode
+from ansible.plugins.action.win_updates import ActionModule
+from ansible.playbook.task import Task
+
+
+def _result(installed, found, reboot_required, changed=False, **kwargs):
+    result = {
+        'changed': changed,
+        'installed_update_count': installed,
+        'found_update_count': found,
+        'reboot_required': reboot_required,
+    }
+    result.update(kwargs)
+    return result
+
+
+class TestWinUpdatesActionPlugin(unittest.TestCase):
+
+    def _get_action(self, args, results):
+        task = MagicMock(Task)
+        task.args = args
+        task.async_val = 0
+        play_context = Mock()
+        play_context.check_mode = False
+
+        action = ActionModule(task, Mock(), play_context, loader=None,
+                              templar=None, shared_loader_obj=None)
+        action._run_win_updates = Mock(side_effect=results)
+        action._reboot_server = Mock()
+        return action
+
+    def test_invalid_category_name(self):
+        action = self._get_action({'category_names': ['Invalid']}, [])
+        result = action.run(task_vars={})
+
+        self.assertTrue(result['failed'])
+        self.assertEqual(result['msg'], "Unknown category_name Invalid, must "
+                         "be one of (Application,Connectors,CriticalUpdates,"
+                         "DefinitionUpdates,DeveloperKits,FeaturePacks,"
+                         "Guidance,SecurityUpdates,ServicePacks,Tools,"
+                         "UpdateRollups,Updates)")
+        self.assertEqual(action._run_win_updates.call_count, 0)
+
+    def test_invalid_category_name_not_a_string(self):
+        action = self._get_action({'category_names': [1]}, [])
+        result = action.run(task_vars={})
+
+        self.assertTrue(result['failed'])
+        self.assertTrue(result['msg'].startswith(
+            "Unknown category_name 1, must be one of ("))
+        self.assertEqual(action._run_win_updates.call_count, 0)
+
+    def test_multiple_invalid_category_names(self):
+        category_names = AnsibleUnicode('Foo, Updates, Bar')
+        action = self._get_action({'category_names': category_names}, [])
+        result = action.run(task_vars={})
+
+        self.assertTrue(result['failed'])
+        self.assertTrue(result['msg'].startswith(
+            "Unknown category_name(s) Foo,Bar; must be one of ("))
+
+    def test_multiple_invalid_category_names_not_strings(self):
+        category_names = ['Updates', None, ['SecurityUpdates'], {'a': 'b'}]
+        action = self._get_action({'category_names': category_names}, [])
+        result = action.run(task_vars={})
+
+        self.assertTrue(result['failed'])
+        self.assertTrue(result['msg'].startswith(
+            "Unknown category_name(s) None,['SecurityUpdates'],{'a': 'b'}; "
+            "must be one of ("))
+        self.assertEqual(action._run_win_updates.call_count, 0)
+
+    def test_reboot_until_converged(self):
+        action = self._get_action({'reboot': True}, [
+            _result(2, 2, False, changed=True, updates={'a': 1}),
+            _result(3, 3, True, changed=True, updates={'b': 2}),
+            _result(0, 0, False),
+        ])
+        result = action.run(task_vars={})
+
+        self.assertEqual(action._run_win_updates.call_count, 3)
+        self.assertEqual(action._reboot_server.call_count, 1)
+        self.assertTrue(result['changed'])
+        self.assertEqual(result['installed_update_count'], 5)
+        self.assertEqual(result['found_update_count'], 5)
+        self.assertEqual(result['updates'], {'a': 1, 'b': 2})
+
+    def test_reboot_stops_without_progress(self):
+        action = self._get_action({'reboot': True}, [
+            _result(0, 0, True),
+            _result(0, 0, True),
+        ])
+        result = action.run(task_vars={})
+
+        self.assertEqual(action._run_win_updates.call_count, 2)
+        self.assertEqual(action._reboot_server.call_count, 1)
+        self.assertTrue(result['changed'])
+
+    def test_reboot_failed_run_then_success(self):
+        action = self._get_action({'reboot': True}, [
+            _result(0, 1, False, failed=True, msg='failure'),
+            _result(1, 1, False, changed=True),
+            _result(0, 0, False),
+        ])
+        result = action.run(task_vars={})
+
+        self.assertEqual(action._run_win_updates.call_count, 3)
+        self.assertEqual(action._reboot_server.call_count, 0)
+        self.assertNotIn('failed', result)
+        self.assertTrue(result['changed'])
+        self.assertEqual(result['installed_update_count'], 1)
+        self.assertEqual(result['found_update_count'], 2)
+
+    def test_reboot_result_missing_counts(self):
+        action = self._get_action({'reboot': True}, [
+            {'changed': False, 'reboot_required': True},
+            {'changed': False, 'installed_update_count': None,
+             'found_update_count': None},
+        ])
+        result = action.run(task_vars={})
+
+        self.assertEqual(action._run_win_updates.call_count, 2)
+        self.assertEqual(action._reboot_server.call_count, 1)
+        self.assertEqual(result['installed_update_count'], 0)
+        self.assertEqual(result['found_update_count'], 0)
+
+    def test_become_as_system_restores_settings(self):
+        action = self._get_action({}, [])
+        play_context = action._play_context
+        play_context.become = False
+        play_context.become_method = 'sudo'
+        play_context.become_user = 'root'
+
+        with self.assertRaises(ValueError):
+            with action._become_as_system():
+                self.assertTrue(play_context.become)
+                self.assertEqual(play_context.become_method, 'runas')
+                self.assertEqual(play_context.become_user, 'SYSTEM')
+                raise ValueError()
+
+        self.assertFalse(play_context.become)
+        self.assertEqual(play_context.become_method, 'sudo')
+        self.assertEqual(play_context.become_user, 'root')